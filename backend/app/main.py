@@ -1,10 +1,16 @@
 """AI Axion - Main FastAPI Application"""
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query
+from fastapi import FastAPI, WebSocket, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
-from typing import Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from dataclasses import asdict
 from datetime import datetime, timezone
-import json
+from functools import lru_cache
+from urllib.parse import quote
+import asyncio
+import orjson
+import os
 
 from app.config import settings
 from app.models import (
@@ -12,25 +18,74 @@ from app.models import (
     SessionStartRequest, PlanRequest, ApprovalRequest,
     PrivilegeRequest, RootPathRequest
 )
-from app.storage import storage
+from app.storage import LOG_CACHE_SIZE, storage
 from app.parser import parse
-from app.tools import ToolExecutor
+from app.tools import ToolExecutor, close_aio_context
 
-# WebSocket connections
-ws_connections: Dict[str, WebSocket] = {}
+# WebSocket outboxes: session_id -> queue drained by that connection's sender task
+ws_outbox: Dict[str, asyncio.Queue] = {}
+
+# Outbound messages arriving within this window are sent as one frame
+WS_BATCH_WINDOW = 0.005
+WS_BATCH_MAX = 50
+
+# Idle seconds before a heartbeat is sent; a failed send closes the connection
+WS_HEARTBEAT_SECONDS = 30
+
+async def _sender(websocket: WebSocket, queue: asyncio.Queue):
+    """Send queued messages, coalescing bursts into a single batch frame"""
+    while True:
+        batch = [await queue.get()]
+        await asyncio.sleep(WS_BATCH_WINDOW)
+        while not queue.empty() and len(batch) < WS_BATCH_MAX:
+            batch.append(queue.get_nowait())
+        
+        # Text frames, since the browser client JSON.parses ev.data directly
+        message = batch[0] if len(batch) == 1 else {"event": "batch", "data": batch}
+        await websocket.send_text(orjson.dumps(message).decode())
+
+async def _recv_loop(websocket: WebSocket, session_id: str):
+    """Answer client messages, sending heartbeats while the connection is idle"""
+    while True:
+        try:
+            await asyncio.wait_for(websocket.receive_text(), timeout=WS_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            _try_enqueue(session_id, {"event": "heartbeat", "data": {}})
+            continue
+        
+        _try_enqueue(session_id, {"event": "pong", "data": {}})
+        # Give other tasks a turn when messages arrive in bursts
+        await asyncio.sleep(0)
+
+def _try_enqueue(session_id: str, payload: Dict) -> bool:
+    """Queue a message for a session's WebSocket without waiting on the socket"""
+    queue = ws_outbox.get(session_id)
+    if queue is None:
+        return False
+    try:
+        queue.put_nowait(payload)
+        return True
+    except asyncio.QueueFull:
+        # Client is not keeping up; drop rather than block the request
+        return False
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize on startup"""
     await storage.init_db()
+    app.state.executors = {}
     yield
     # Cleanup on shutdown
+    app.state.executors.clear()
+    close_aio_context()
+    await storage.close()
 
 app = FastAPI(
     title="AI Axion",
     description="Local Jarvis-Style Desktop Assistant",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -42,16 +97,50 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_allowed_scopes(mode: str) -> List[str]:
+def get_executor(root_path: str) -> ToolExecutor:
+    """Get the shared tool executor for a root path"""
+    executors: Dict[str, ToolExecutor] = app.state.executors
+    executor = executors.get(root_path)
+    if executor is None:
+        executor = executors[root_path] = ToolExecutor(root_path)
+    return executor
+
+def _allows_outside(session: Optional[Session]) -> bool:
+    """Whether a session may use paths outside its sandbox"""
+    return session is not None and "files.outside_sandbox" in session.allowed_scopes
+
+async def _run_tool(executor: ToolExecutor, action: Action, session: Optional[Session]) -> Dict[str, Any]:
+    """Execute an action's tool; a read too big to inline points at the download endpoint"""
+    result = await executor.execute(action.tool, action.args, allow_outside=_allows_outside(session))
+    if action.tool == "files.read" and result.get("streamed"):
+        result["download_url"] = f"/api/action/{action.id}/download?session_id={action.session_id}"
+    return result
+
+async def _started(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Start a stream now, so errors opening it surface before a response is sent"""
+    first = await anext(stream, b"")
+    
+    async def chunks():
+        yield first
+        async for chunk in stream:
+            yield chunk
+    
+    return chunks()
+
+# Policy helpers are pure functions of a handful of strings, so they are memoized
+
+@lru_cache(maxsize=256)
+def get_allowed_scopes(mode: str) -> Tuple[str, ...]:
     """Get allowed scopes based on mode"""
     if mode == "paranoid":
-        return ["system.read"]
+        return ("system.read",)
     elif mode == "normal":
-        return ["apps.open", "system.read", "files.sandbox_rw", "browser.basic"]
+        return ("apps.open", "system.read", "files.sandbox_rw", "browser.basic")
     else:  # hands_free
-        return ["apps.open", "system.read", "files.sandbox_rw", "browser.basic", "files.outside_sandbox"]
+        return ("apps.open", "system.read", "files.sandbox_rw", "browser.basic", "files.outside_sandbox")
 
-def assess_risk(tool: str, args: Dict) -> str:
+@lru_cache(maxsize=256)
+def assess_risk(tool: str) -> str:
     """Assess risk level of an action"""
     if tool.startswith("system.") and tool != "system.time":
         return "high"
@@ -64,6 +153,7 @@ def assess_risk(tool: str, args: Dict) -> str:
     else:
         return "low"
 
+@lru_cache(maxsize=256)
 def needs_approval(tool: str, risk: str, mode: str) -> bool:
     """Determine if action needs approval"""
     if mode == "paranoid":
@@ -83,9 +173,9 @@ async def start_session(request: SessionStartRequest):
     """Create a new session"""
     session = Session(
         mode=request.mode,
-        allowed_scopes=get_allowed_scopes(request.mode),
+        allowed_scopes=list(get_allowed_scopes(request.mode)),
         expires_in_minutes=settings.max_session_minutes,
-        root_path=await storage.get_setting("root_path", settings.sandbox_path)
+        root_path=storage.get_setting("root_path", settings.sandbox_path)
     )
     
     await storage.save_session(session)
@@ -96,7 +186,7 @@ async def start_session(request: SessionStartRequest):
 async def create_plan(request: PlanRequest):
     """Parse utterance and create action plan"""
     # Get session
-    session = await storage.get_session(request.session_id)
+    session = storage.get_session(request.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -116,7 +206,7 @@ async def create_plan(request: PlanRequest):
         args=parse_result.args,
         need_approval=False,  # Will be determined below
         reason_brief="proposed by rules",
-        risk=assess_risk(parse_result.intent, parse_result.args),
+        risk=assess_risk(parse_result.intent),
         session_id=session.id
     )
     
@@ -130,9 +220,9 @@ async def create_plan(request: PlanRequest):
     # Auto-execute if no approval needed
     auto_results = []
     if not action.need_approval:
-        executor = ToolExecutor(session.root_path)
+        executor = get_executor(session.root_path)
         try:
-            result = await executor.execute(action.tool, action.args)
+            result = await _run_tool(executor, action, session)
             action_result = ActionResult(
                 action_id=action.id,
                 success=True,
@@ -140,7 +230,7 @@ async def create_plan(request: PlanRequest):
                 error=None
             )
             
-            # Log the action
+            # Log the action and remove it from pending actions
             log_entry = LogEntry(
                 action_id=action.id,
                 tool=action.tool,
@@ -150,22 +240,15 @@ async def create_plan(request: PlanRequest):
                 error=None,
                 session_id=session.id
             )
-            await storage.save_log(log_entry)
-            
-            # Remove from pending actions
-            await storage.delete_action(action.id)
+            await storage.atomic_finalize(log_entry, action.id)
             
             auto_results.append(action_result)
             
             # Send WebSocket notification
-            if session.id in ws_connections:
-                try:
-                    await ws_connections[session.id].send_json({
-                        "event": "tool_result",
-                        "data": action_result.dict()
-                    })
-                except:
-                    pass
+            _try_enqueue(session.id, {
+                "event": "tool_result",
+                "data": asdict(action_result)
+            })
         except Exception as e:
             action_result = ActionResult(
                 action_id=action.id,
@@ -184,14 +267,14 @@ async def create_plan(request: PlanRequest):
 async def approve_action(request: ApprovalRequest):
     """Approve or deny an action"""
     # Get action
-    action = await storage.get_action(request.action_id)
+    action = storage.get_action(request.action_id)
     if not action:
         raise HTTPException(status_code=404, detail="Action not found")
     
     # Get session (if it exists)
     session = None
     if action.session_id:
-        session = await storage.get_session(action.session_id)
+        session = storage.get_session(action.session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
     
@@ -207,8 +290,9 @@ async def approve_action(request: ApprovalRequest):
                 error="User denied action",
                 session_id=session.id
             )
-            await storage.save_log(log_entry)
-        await storage.delete_action(request.action_id)
+            await storage.atomic_finalize(log_entry, request.action_id)
+        else:
+            storage.delete_action(request.action_id)
         
         return {
             "action_id": request.action_id,
@@ -219,12 +303,12 @@ async def approve_action(request: ApprovalRequest):
     
     # Execute the action
     root_path = session.root_path if session else settings.sandbox_path
-    executor = ToolExecutor(root_path)
+    executor = get_executor(root_path)
     
     try:
-        result = await executor.execute(action.tool, action.args)
+        result = await _run_tool(executor, action, session)
         
-        # Log success
+        # Log success and remove from pending actions
         if session:
             log_entry = LogEntry(
                 action_id=action.id,
@@ -235,24 +319,20 @@ async def approve_action(request: ApprovalRequest):
                 error=None,
                 session_id=session.id
             )
-            await storage.save_log(log_entry)
-        
-        # Remove from pending actions
-        await storage.delete_action(request.action_id)
+            await storage.atomic_finalize(log_entry, request.action_id)
+        else:
+            storage.delete_action(request.action_id)
         
         # Send WebSocket notification
-        if session and session.id in ws_connections:
-            try:
-                await ws_connections[session.id].send_json({
-                    "event": "tool_result",
-                    "data": {
-                        "action_id": action.id,
-                        "success": True,
-                        "result": result
-                    }
-                })
-            except:
-                pass
+        if session:
+            _try_enqueue(session.id, {
+                "event": "tool_result",
+                "data": {
+                    "action_id": action.id,
+                    "success": True,
+                    "result": result
+                }
+            })
         
         return {
             "action_id": request.action_id,
@@ -282,17 +362,49 @@ async def approve_action(request: ApprovalRequest):
             "error": str(e)
         }
 
+@app.get("/api/action/{action_id}/download")
+async def download_action_file(action_id: str, session_id: str = Query(...)):
+    """Stream the file behind a files.read that was too large to return inline"""
+    session = storage.get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    log = await storage.get_log(session_id, action_id)
+    if log is None or log.tool != "files.read" or not log.success or not (log.result or {}).get("streamed"):
+        raise HTTPException(status_code=404, detail="Download not found")
+    
+    filename = log.args.get("filename")
+    executor = get_executor(session.root_path)
+    try:
+        # Checked again, since the path may have been swapped for a link since the read
+        if not _allows_outside(session):
+            await asyncio.to_thread(executor.check_paths, {"filename": filename})
+        stream = await _started(executor.files_read_stream(filename))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    return StreamingResponse(
+        stream,
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f"attachment; filename*=utf-8''{quote(os.path.basename(filename))}",
+            "X-Action-Id": action_id
+        }
+    )
+
 @app.get("/api/logs")
-async def get_logs(session_id: str = Query(...)):
-    """Get action logs for a session"""
-    logs = await storage.get_logs(session_id)
+async def get_logs(session_id: str = Query(...), limit: int = Query(LOG_CACHE_SIZE)):
+    """Get the most recent action logs for a session"""
+    logs = await storage.fetch_logs(session_id, limit)
     return {"logs": logs}
 
 @app.get("/api/settings/root")
 async def get_root_settings():
     """Get current root path settings"""
-    root = await storage.get_setting("root_path", settings.sandbox_path)
-    first_run = await storage.get_setting("first_run", True)
+    root = storage.get_setting("root_path", settings.sandbox_path)
+    first_run = storage.get_setting("first_run", True)
     
     return {
         "root": root,
@@ -336,18 +448,36 @@ async def request_privilege(request: PrivilegeRequest):
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """WebSocket endpoint for real-time updates"""
     await websocket.accept()
-    ws_connections[session_id] = websocket
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+    ws_outbox[session_id] = queue
+    
+    # Receiving and sending run separately so neither blocks the other;
+    # when one ends (disconnect or failed send) the other is cancelled
+    recv_task = asyncio.create_task(_recv_loop(websocket, session_id))
+    send_task = asyncio.create_task(_sender(websocket, queue))
     
     try:
-        while True:
-            # Keep connection alive
-            data = await websocket.receive_text()
-            # Echo back or handle commands
-            await websocket.send_json({"event": "pong", "data": {}})
-    except WebSocketDisconnect:
-        if session_id in ws_connections:
-            del ws_connections[session_id]
+        await asyncio.wait({recv_task, send_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if ws_outbox.get(session_id) is queue:
+            del ws_outbox[session_id]
+        recv_task.cancel()
+        send_task.cancel()
+        await asyncio.gather(recv_task, send_task, return_exceptions=True)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=settings.host, port=settings.port)
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        # uvloop is not available on Windows
+        loop = "asyncio"
+    uvicorn.run(
+        app,
+        host=settings.host,
+        port=settings.port,
+        loop=loop,
+        http="httptools",
+        ws="websockets"
+    )
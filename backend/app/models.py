@@ -1,44 +1,57 @@
 """Data models"""
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Literal, Optional
-from pydantic import BaseModel, Field
-import uuid
+from pydantic import BaseModel
+import secrets
 
-class ParseResult(BaseModel):
+# Internal records built on every request are plain slotted dataclasses;
+# pydantic is kept for the request bodies FastAPI validates.
+
+def new_id() -> str:
+    """Random 32-char hex id for sessions and actions"""
+    return secrets.token_hex(16)
+
+@dataclass(slots=True, kw_only=True)
+class ParseResult:
     """Result from command parser"""
     intent: str
     args: Dict[str, Any]
     confidence: float
     source: Literal["rules", "llm"]
 
-class Action(BaseModel):
+@dataclass(slots=True, kw_only=True)
+class Action:
     """Proposed action"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = field(default_factory=new_id)
     tool: str
     args: Dict[str, Any]
     need_approval: bool
     reason_brief: str
     risk: Literal["low", "medium", "high"]
     session_id: Optional[str] = None
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
 
-class ActionResult(BaseModel):
+@dataclass(slots=True, kw_only=True)
+class ActionResult:
     """Result of action execution"""
     action_id: str
     success: bool
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
 
-class Session(BaseModel):
+@dataclass(slots=True, kw_only=True)
+class Session:
     """User session"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = field(default_factory=new_id)
     mode: Literal["paranoid", "normal", "hands_free"]
     allowed_scopes: List[str]
     expires_in_minutes: int
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
     root_path: str = ""
 
-class LogEntry(BaseModel):
+@dataclass(slots=True, kw_only=True)
+class LogEntry:
     """Action log entry"""
     action_id: str
     tool: str
@@ -46,7 +59,7 @@ class LogEntry(BaseModel):
     success: bool
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
     session_id: str
 
 class SessionStartRequest(BaseModel):
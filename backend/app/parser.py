@@ -1,57 +1,68 @@
 """Hybrid command parser - rules-first with optional LLM fallback"""
 import re
-from typing import Dict, Any, Tuple, Optional
+from typing import Dict, Any, List, Pattern, Tuple, Optional
 from app.models import ParseResult
 from app.config import settings
 
-# Rule-based patterns
+# Rule-based patterns: (first words, pattern, intent, (arg name, group) pairs, confidence)
 RULES = [
     # Time queries
-    (r'^(what time is it|current time|time|what\'s the time)\??$', 
-     'system.time', {}, 1.0),
+    (('what', 'current', 'time', "what's"),
+     r'^(what time is it|current time|time|what\'s the time)\??$', 
+     'system.time', (), 1.0),
     
     # File write
-    (r'^write file ([\w\.\-]+):\s*(.+)$', 
-     'files.write', lambda m: {'filename': m.group(1), 'content': m.group(2)}, 0.95),
+    (('write',), r'^write file ([\w\.\-]+):\s*(.+)$', 
+     'files.write', (('filename', 1), ('content', 2)), 0.95),
     
     # File read
-    (r'^read file ([\w\.\-]+)$', 
-     'files.read', lambda m: {'filename': m.group(1)}, 0.95),
+    (('read',), r'^read file ([\w\.\-]+)$', 
+     'files.read', (('filename', 1),), 0.95),
     
     # File delete
-    (r'^delete file ([\w\.\-]+)$', 
-     'files.delete', lambda m: {'filename': m.group(1)}, 0.95),
+    (('delete',), r'^delete file ([\w\.\-]+)$', 
+     'files.delete', (('filename', 1),), 0.95),
     
     # File copy
-    (r'^copy file ([\w\.\-]+) to ([\w\.\-]+)$', 
-     'files.copy', lambda m: {'source': m.group(1), 'dest': m.group(2)}, 0.95),
+    (('copy',), r'^copy file ([\w\.\-]+) to ([\w\.\-]+)$', 
+     'files.copy', (('source', 1), ('dest', 2)), 0.95),
     
     # File move
-    (r'^move file ([\w\.\-]+) to ([\w\.\-]+)$', 
-     'files.move', lambda m: {'source': m.group(1), 'dest': m.group(2)}, 0.95),
+    (('move',), r'^move file ([\w\.\-]+) to ([\w\.\-]+)$', 
+     'files.move', (('source', 1), ('dest', 2)), 0.95),
     
     # List files
-    (r'^(list files|ls|dir|show files)(\s+in\s+([\w\.\-/]+))?$', 
-     'files.list', lambda m: {'path': m.group(3) if m.group(3) else ''}, 0.90),
+    (('list', 'ls', 'dir', 'show'),
+     r'^(list files|ls|dir|show files)(\s+in\s+([\w\.\-/]+))?$', 
+     'files.list', (('path', 3),), 0.90),
     
     # Open application
-    (r'^open (chrome|firefox|safari|edge|browser|notepad|calculator|terminal)$', 
-     'apps.open', lambda m: {'app': m.group(1)}, 0.90),
+    (('open',), r'^open (chrome|firefox|safari|edge|browser|notepad|calculator|terminal)$', 
+     'apps.open', (('app', 1),), 0.90),
 ]
 
+# Precompiled rules keyed by the first word of the utterance, so only the
+# rules that can possibly match are tried
+_DISPATCH: Dict[str, List[Tuple[Pattern[str], str, Tuple[Tuple[str, int], ...], float]]] = {}
+for words, pattern, intent, args_spec, confidence in RULES:
+    compiled = (re.compile(pattern), intent, args_spec, confidence)
+    for word in words:
+        _DISPATCH.setdefault(word, []).append(compiled)
+
 def parse_with_rules(utterance: str) -> Tuple[Optional[str], Dict[str, Any], float]:
     """Parse utterance using rule-based patterns"""
-    text = utterance.lower().strip()
+    text = utterance.strip()
+    if not text.islower():
+        text = text.lower()
+    
+    # Split on any whitespace, as the patterns' \s+ does
+    first = text.split(None, 1)[0] if text else ""
     
-    for pattern, intent, args_fn, confidence in RULES:
-        match = re.match(pattern, text)
+    for pattern, intent, args_spec, confidence in _DISPATCH.get(first.rstrip("?"), ()):
+        match = pattern.match(text)
         if match:
-            # Extract args
-            if callable(args_fn):
-                args = args_fn(match)
-            else:
-                args = args_fn
-            
+            # Extract args; optional groups that did not match become ''
+            args = {name: match.group(i) or '' for name, i in args_spec}
             return intent, args, confidence
     
     # No match found
@@ -75,81 +86,26 @@ def parse(utterance: str, context: Optional[Dict[str, Any]] = None) -> ParseResu
     # Try rules first
     intent, args, confidence = parse_with_rules(utterance)
     
+    # Decide whether the LLM gets a say
     if intent and confidence >= settings.confidence_high:
         # High confidence rule match
-        return ParseResult(
-            intent=intent,
-            args=args,
-            confidence=confidence,
-            source="rules"
-        )
+        use_llm = False
+    elif settings.parser_mode == "hybrid":
+        # Medium confidence keeps the rule result, anything lower asks the LLM
+        use_llm = not (intent and confidence >= settings.confidence_low)
+    else:
+        use_llm = settings.parser_mode == "llm"
     
-    # Check parser mode
-    if settings.parser_mode == "rules":
-        # Rules only mode
-        if intent:
-            return ParseResult(
-                intent=intent,
-                args=args,
-                confidence=confidence,
-                source="rules"
-            )
-        else:
-            return ParseResult(
-                intent="unknown",
-                args={"utterance": utterance},
-                confidence=0.0,
-                source="rules"
-            )
+    if use_llm and settings.llm_api_key:
+        return parse_with_llm(utterance, context)
     
-    elif settings.parser_mode == "hybrid":
-        # Hybrid mode: use LLM fallback if confidence is low
-        if intent and confidence >= settings.confidence_low:
-            # Medium confidence, use rule result
-            return ParseResult(
-                intent=intent,
-                args=args,
-                confidence=confidence,
-                source="rules"
-            )
-        else:
-            # Low confidence or no match, try LLM
-            if settings.llm_api_key:
-                return parse_with_llm(utterance, context)
-            else:
-                # No LLM available, return best rule match or unknown
-                if intent:
-                    return ParseResult(
-                        intent=intent,
-                        args=args,
-                        confidence=confidence,
-                        source="rules"
-                    )
-                else:
-                    return ParseResult(
-                        intent="unknown",
-                        args={"utterance": utterance},
-                        confidence=0.0,
-                        source="rules"
-                    )
+    # Best rule match, or unknown (also the fallback when no LLM is available)
+    if not intent:
+        intent, args, confidence = "unknown", {"utterance": utterance}, 0.0
     
-    else:  # llm mode
-        # Always use LLM
-        if settings.llm_api_key:
-            return parse_with_llm(utterance, context)
-        else:
-            # Fall back to rules if no LLM available
-            if intent:
-                return ParseResult(
-                    intent=intent,
-                    args=args,
-                    confidence=confidence,
-                    source="rules"
-                )
-            else:
-                return ParseResult(
-                    intent="unknown",
-                    args={"utterance": utterance},
-                    confidence=0.0,
-                    source="rules"
-                )
\ No newline at end of file
+    return ParseResult(
+        intent=intent,
+        args=args,
+        confidence=confidence,
+        source="rules"
+    )
@@ -1,12 +1,43 @@
 """Storage layer - SQLite with in-memory cache"""
 import aiosqlite
-import json
-from datetime import datetime, timezone
-from typing import Dict, List, Optional, Any
+import asyncio
+from collections import deque
+from itertools import groupby
+import logging
+import orjson
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Any, Sequence, Set, Tuple
 from pathlib import Path
 from app.models import Session, Action, LogEntry
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+# Max queued write units committed in one transaction by the writer task
+WRITE_BATCH_MAX = 100
+
+# Most recent log entries kept in memory per session; older ones live in SQLite
+LOG_CACHE_SIZE = 1000
+
+# A write unit: statements that are always committed together
+WriteUnit = Sequence[Tuple[str, tuple]]
+
+# Write statements, kept as constants so the writer can executemany
+# consecutive statements with identical SQL
+_INSERT_SETTING = "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)"
+_INSERT_SESSION = """INSERT OR REPLACE INTO sessions 
+    (id, mode, allowed_scopes, expires_in_minutes, created_at, root_path)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+_INSERT_ACTION = """INSERT OR REPLACE INTO actions 
+    (id, tool, args, need_approval, reason_brief, risk, session_id, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+_INSERT_LOG = """INSERT OR REPLACE INTO logs 
+    (action_id, tool, args, success, result, error, timestamp, session_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+_DELETE_ACTION = "DELETE FROM actions WHERE id = ?"
+_SELECT_LOGS = """SELECT action_id, tool, args, success, result, error, timestamp, session_id
+    FROM logs"""
+
 class Storage:
     """Hybrid storage with SQLite persistence and in-memory cache"""
     
@@ -17,124 +48,258 @@ class Storage:
         # In-memory cache
         self.sessions: Dict[str, Session] = {}
         self.actions: Dict[str, Action] = {}
-        self.logs: Dict[str, List[LogEntry]] = {}  # session_id -> logs
+        self.logs: Dict[str, Deque[LogEntry]] = {}  # session_id -> recent logs
+        # Sessions whose cached logs are their whole history, so SQLite can be skipped
+        self._logs_complete: Set[str] = set()
         self.settings_cache: Dict[str, Any] = {
             "root_path": settings.sandbox_path,
             "first_run": True
         }
         
+        # Shared SQLite connection, opened lazily and kept for the app lifetime
+        self._db: Optional[aiosqlite.Connection] = None
+        
+        # Background writer; created in init_db so it binds to the running loop
+        self._write_q: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+    
+    async def _conn(self) -> aiosqlite.Connection:
+        """Get the shared database connection"""
+        if self._db is None:
+            self._db = await aiosqlite.connect(self.db_path)
+        return self._db
+    
+    async def close(self):
+        """Flush pending writes and close the shared database connection"""
+        if self._writer is not None:
+            await self._flush()
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.exception("Background writer failed")
+            self._writer = None
+            self._write_q = None
+        
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+        
     async def init_db(self):
         """Initialize SQLite database"""
         if self.mode != "sqlite":
             return
         
-        async with aiosqlite.connect(self.db_path) as db:
-            # Sessions table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS sessions (
-                    id TEXT PRIMARY KEY,
-                    mode TEXT NOT NULL,
-                    allowed_scopes TEXT NOT NULL,
-                    expires_in_minutes INTEGER NOT NULL,
-                    created_at TEXT NOT NULL,
-                    root_path TEXT
-                )
-            """)
-            
-            # Actions table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS actions (
-                    id TEXT PRIMARY KEY,
-                    tool TEXT NOT NULL,
-                    args TEXT NOT NULL,
-                    need_approval INTEGER NOT NULL,
-                    reason_brief TEXT,
-                    risk TEXT NOT NULL,
-                    session_id TEXT,
-                    timestamp TEXT NOT NULL
-                )
-            """)
-            
-            # Logs table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS logs (
-                    action_id TEXT PRIMARY KEY,
-                    tool TEXT NOT NULL,
-                    args TEXT NOT NULL,
-                    success INTEGER NOT NULL,
-                    result TEXT,
-                    error TEXT,
-                    timestamp TEXT NOT NULL,
-                    session_id TEXT NOT NULL
-                )
-            """)
-            
-            # Settings table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
-                )
-            """)
+        db = await self._conn()
+        
+        # WAL lets readers run alongside the writer and needs far fewer fsyncs
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute("PRAGMA temp_store=MEMORY")
+        await db.execute("PRAGMA mmap_size=268435456")
+        
+        # Sessions table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                mode TEXT NOT NULL,
+                allowed_scopes TEXT NOT NULL,
+                expires_in_minutes INTEGER NOT NULL,
+                created_at TEXT NOT NULL,
+                root_path TEXT
+            )
+        """)
+        
+        # Actions table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS actions (
+                id TEXT PRIMARY KEY,
+                tool TEXT NOT NULL,
+                args TEXT NOT NULL,
+                need_approval INTEGER NOT NULL,
+                reason_brief TEXT,
+                risk TEXT NOT NULL,
+                session_id TEXT,
+                timestamp TEXT NOT NULL
+            )
+        """)
+        
+        # Logs table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS logs (
+                action_id TEXT PRIMARY KEY,
+                tool TEXT NOT NULL,
+                args TEXT NOT NULL,
+                success INTEGER NOT NULL,
+                result TEXT,
+                error TEXT,
+                timestamp TEXT NOT NULL,
+                session_id TEXT NOT NULL
+            )
+        """)
+        
+        # Settings table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        
+        # Indexes for per-session lookups
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_logs_session ON logs(session_id, timestamp DESC)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_actions_session ON actions(session_id)")
+        
+        await db.commit()
+        
+        # Load settings, sessions and pending actions from DB
+        await self.warm_cache()
+        
+        # Start the background writer
+        self._write_q = asyncio.Queue()
+        self._writer = asyncio.create_task(self._writer_loop())
+    
+    def _enqueue(self, unit: WriteUnit):
+        """Queue statements for the background writer"""
+        self._write_q.put_nowait(unit)
+    
+    async def _flush(self):
+        """Wait until everything queued so far is committed"""
+        if self._writer is None or self._writer.done():
+            return
+        
+        # A marker behind the queued units; the writer resolves it once they are
+        # committed, so later writes don't hold this up
+        marker = asyncio.get_running_loop().create_future()
+        self._write_q.put_nowait(marker)
+        await asyncio.wait({marker, self._writer}, return_when=asyncio.FIRST_COMPLETED)
+    
+    async def _writer_loop(self):
+        """Commit queued writes off the request path, one transaction per batch"""
+        db = await self._conn()
+        
+        while True:
+            batch = [await self._write_q.get()]
+            while not self._write_q.empty() and len(batch) < WRITE_BATCH_MAX:
+                batch.append(self._write_q.get_nowait())
             
+            units = [item for item in batch if not isinstance(item, asyncio.Future)]
+            try:
+                await self._commit(db, [stmt for unit in units for stmt in unit])
+            except Exception:
+                # Retry each unit in its own transaction so one bad statement
+                # doesn't drop the rest of the batch
+                for unit in units:
+                    try:
+                        await self._commit(db, unit)
+                    except Exception:
+                        logger.exception("Dropped queued write: %s", unit)
+            finally:
+                for item in batch:
+                    if isinstance(item, asyncio.Future) and not item.done():
+                        item.set_result(None)
+    
+    @staticmethod
+    async def _commit(db: aiosqlite.Connection, statements: WriteUnit):
+        """Run statements in one transaction"""
+        try:
+            # Runs of the same statement go to SQLite in one executemany call
+            for sql, run in groupby(statements, key=lambda stmt: stmt[0]):
+                await db.executemany(sql, [params for _, params in run])
             await db.commit()
-            
-        # Load settings from DB
-        await self.load_settings()
+        except Exception:
+            await db.rollback()
+            raise
     
-    async def load_settings(self):
-        """Load settings from database"""
+    async def warm_cache(self):
+        """Load settings, recent sessions and pending actions from the database"""
         if self.mode != "sqlite":
             return
-            
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT key, value FROM settings") as cursor:
-                async for row in cursor:
-                    key, value = row
-                    try:
-                        self.settings_cache[key] = json.loads(value)
-                    except:
-                        self.settings_cache[key] = value
+        
+        db = await self._conn()
+        async with db.execute("SELECT key, value FROM settings") as cursor:
+            async for row in cursor:
+                key, value = row
+                try:
+                    self.settings_cache[key] = orjson.loads(value)
+                except:
+                    self.settings_cache[key] = value
+        
+        # Only sessions (and their actions) that could still be in use
+        cutoff = (
+            datetime.now(timezone.utc) - timedelta(minutes=settings.max_session_minutes)
+        ).isoformat()
+        
+        async with db.execute(
+            """SELECT id, mode, allowed_scopes, expires_in_minutes, created_at, root_path
+            FROM sessions WHERE created_at > ?""",
+            (cutoff,)
+        ) as cursor:
+            async for session_id, mode, allowed_scopes, expires_in_minutes, created_at, root_path in cursor:
+                self.sessions[session_id] = Session(
+                    id=session_id,
+                    mode=mode,
+                    allowed_scopes=orjson.loads(allowed_scopes),
+                    expires_in_minutes=expires_in_minutes,
+                    created_at=datetime.fromisoformat(created_at),
+                    root_path=root_path or ""
+                )
+        
+        async with db.execute(
+            """SELECT id, tool, args, need_approval, reason_brief, risk, session_id, timestamp
+            FROM actions WHERE timestamp > ?""",
+            (cutoff,)
+        ) as cursor:
+            async for action_id, tool, args, need_approval, reason_brief, risk, session_id, timestamp in cursor:
+                self.actions[action_id] = Action(
+                    id=action_id,
+                    tool=tool,
+                    args=orjson.loads(args),
+                    need_approval=bool(need_approval),
+                    reason_brief=reason_brief,
+                    risk=risk,
+                    session_id=session_id,
+                    timestamp=datetime.fromisoformat(timestamp)
+                )
     
     async def save_setting(self, key: str, value: Any):
         """Save a setting"""
         self.settings_cache[key] = value
         
         if self.mode == "sqlite":
-            async with aiosqlite.connect(self.db_path) as db:
-                value_str = json.dumps(value) if not isinstance(value, str) else value
-                await db.execute(
-                    "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-                    (key, value_str)
-                )
-                await db.commit()
+            value_str = orjson.dumps(value).decode() if not isinstance(value, str) else value
+            self._enqueue([(
+                _INSERT_SETTING,
+                (key, value_str)
+            )])
     
-    async def get_setting(self, key: str, default: Any = None) -> Any:
+    def get_setting(self, key: str, default: Any = None) -> Any:
         """Get a setting"""
         return self.settings_cache.get(key, default)
     
     async def save_session(self, session: Session):
         """Save session"""
+        if session.id not in self.sessions:
+            # Created in this process, so every log it will have passes through the cache
+            self._logs_complete.add(session.id)
         self.sessions[session.id] = session
         
         if self.mode == "sqlite":
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    """INSERT OR REPLACE INTO sessions 
-                    (id, mode, allowed_scopes, expires_in_minutes, created_at, root_path)
-                    VALUES (?, ?, ?, ?, ?, ?)""",
-                    (
-                        session.id,
-                        session.mode,
-                        json.dumps(session.allowed_scopes),
-                        session.expires_in_minutes,
-                        session.created_at.isoformat(),
-                        session.root_path
-                    )
+            self._enqueue([(
+                _INSERT_SESSION,
+                (
+                    session.id,
+                    session.mode,
+                    orjson.dumps(session.allowed_scopes).decode(),
+                    session.expires_in_minutes,
+                    session.created_at.isoformat(),
+                    session.root_path
                 )
-                await db.commit()
+            )])
     
-    async def get_session(self, session_id: str) -> Optional[Session]:
+    def get_session(self, session_id: str) -> Optional[Session]:
         """Get session"""
         return self.sessions.get(session_id)
     
@@ -143,61 +308,145 @@ class Storage:
         self.actions[action.id] = action
         
         if self.mode == "sqlite":
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    """INSERT OR REPLACE INTO actions 
-                    (id, tool, args, need_approval, reason_brief, risk, session_id, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (
-                        action.id,
-                        action.tool,
-                        json.dumps(action.args),
-                        1 if action.need_approval else 0,
-                        action.reason_brief,
-                        action.risk,
-                        action.session_id,
-                        action.timestamp.isoformat()
-                    )
+            self._enqueue([(
+                _INSERT_ACTION,
+                (
+                    action.id,
+                    action.tool,
+                    orjson.dumps(action.args).decode(),
+                    1 if action.need_approval else 0,
+                    action.reason_brief,
+                    action.risk,
+                    action.session_id,
+                    action.timestamp.isoformat()
                 )
-                await db.commit()
+            )])
     
-    async def get_action(self, action_id: str) -> Optional[Action]:
+    def get_action(self, action_id: str) -> Optional[Action]:
         """Get action"""
         return self.actions.get(action_id)
     
-    async def delete_action(self, action_id: str):
+    def delete_action(self, action_id: str):
         """Delete action after approval/denial"""
-        if action_id in self.actions:
-            del self.actions[action_id]
+        self.actions.pop(action_id, None)
+        
+        if self.mode == "sqlite":
+            self._enqueue([self._delete_action_stmt(action_id)])
     
     async def save_log(self, log: LogEntry):
         """Save log entry"""
-        if log.session_id not in self.logs:
-            self.logs[log.session_id] = []
-        self.logs[log.session_id].append(log)
+        self._cache_log(log)
         
         if self.mode == "sqlite":
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    """INSERT OR REPLACE INTO logs 
-                    (action_id, tool, args, success, result, error, timestamp, session_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (
-                        log.action_id,
-                        log.tool,
-                        json.dumps(log.args),
-                        1 if log.success else 0,
-                        json.dumps(log.result) if log.result else None,
-                        log.error,
-                        log.timestamp.isoformat(),
-                        log.session_id
-                    )
-                )
-                await db.commit()
+            self._enqueue([self._insert_log_stmt(log)])
+    
+    async def atomic_finalize(self, log: LogEntry, action_id: str):
+        """Log a finished action and drop it from pending in one transaction"""
+        self._cache_log(log)
+        self.actions.pop(action_id, None)
+        
+        if self.mode == "sqlite":
+            self._enqueue([
+                self._insert_log_stmt(log),
+                self._delete_action_stmt(action_id)
+            ])
+    
+    def _cache_log(self, log: LogEntry):
+        """Append log entry to the session's in-memory cache"""
+        if log.session_id not in self.logs:
+            self.logs[log.session_id] = deque(maxlen=LOG_CACHE_SIZE)
+        cached = self.logs[log.session_id]
+        if len(cached) == LOG_CACHE_SIZE:
+            # The oldest entry is about to be evicted
+            self._logs_complete.discard(log.session_id)
+        cached.append(log)
+    
+    @staticmethod
+    def _insert_log_stmt(log: LogEntry) -> Tuple[str, tuple]:
+        return (
+            _INSERT_LOG,
+            (
+                log.action_id,
+                log.tool,
+                orjson.dumps(log.args).decode(),
+                1 if log.success else 0,
+                orjson.dumps(log.result).decode() if log.result else None,
+                log.error,
+                log.timestamp.isoformat(),
+                log.session_id
+            )
+        )
+    
+    @staticmethod
+    def _delete_action_stmt(action_id: str) -> Tuple[str, tuple]:
+        return (_DELETE_ACTION, (action_id,))
+    
+    async def fetch_logs(self, session_id: str, limit: int = -1) -> List[LogEntry]:
+        """Get logs for session, oldest first, reading SQLite when the cache is incomplete"""
+        cached = self.logs.get(session_id, ())
+        # The cache always holds the newest entries, so it can serve any
+        # limit it covers even after evicting older ones
+        if self.mode != "sqlite" or session_id in self._logs_complete or 0 < limit <= len(cached):
+            logs = list(cached)
+            return logs[-limit:] if limit > 0 else logs
+        
+        # Cache has evicted entries, or the session predates this process
+        await self._flush()
+        db = await self._conn()
+        async with db.execute(
+            _SELECT_LOGS + " WHERE session_id = ? ORDER BY timestamp DESC LIMIT ?",
+            (session_id, limit)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        
+        logs = [self._log_from_row(row) for row in reversed(rows)]
+        
+        # A full history that fits becomes the cache; entries logged while the
+        # query ran are kept at the end. Only known sessions are cached, so
+        # lookups for unknown ids allocate nothing.
+        full = limit <= 0 or len(rows) < limit
+        if full and session_id in self.sessions and len(logs) <= LOG_CACHE_SIZE:
+            seen = {log.action_id for log in logs}
+            logs += [log for log in self.logs.get(session_id, ()) if log.action_id not in seen]
+            if len(logs) <= LOG_CACHE_SIZE:
+                self.logs[session_id] = deque(logs, maxlen=LOG_CACHE_SIZE)
+                self._logs_complete.add(session_id)
+        
+        return logs
+    
+    async def get_log(self, session_id: str, action_id: str) -> Optional[LogEntry]:
+        """Get one log entry of a session by action id"""
+        for log in reversed(self.logs.get(session_id, ())):
+            if log.action_id == action_id:
+                return log
+        
+        if self.mode != "sqlite" or session_id in self._logs_complete:
+            return None
+        
+        # action_id is the primary key, so this is a single index lookup
+        await self._flush()
+        db = await self._conn()
+        async with db.execute(
+            _SELECT_LOGS + " WHERE action_id = ? AND session_id = ?",
+            (action_id, session_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+        
+        return self._log_from_row(row) if row else None
     
-    async def get_logs(self, session_id: str) -> List[LogEntry]:
-        """Get logs for session"""
-        return self.logs.get(session_id, [])
+    @staticmethod
+    def _log_from_row(row: tuple) -> LogEntry:
+        action_id, tool, args, success, result, error, timestamp, session_id = row
+        return LogEntry(
+            action_id=action_id,
+            tool=tool,
+            args=orjson.loads(args),
+            success=bool(success),
+            result=orjson.loads(result) if result else None,
+            error=error,
+            timestamp=datetime.fromisoformat(timestamp),
+            session_id=session_id
+        )
 
 # Global storage instance
 storage = Storage()
\ No newline at end of file
@@ -1,17 +1,87 @@
 """Tool execution layer"""
+import asyncio
+import inspect
 import os
 import shutil
+import time
+import aiofiles
+import anyio
+import caio
+from aiofile import AIOFile, Reader
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, Optional, Tuple, TypeVar
 from app.config import settings
 
+# Writes larger than this are split into chunks submitted concurrently through
+# aiofile (caio: io_uring/libaio on Linux, a thread pool elsewhere); smaller
+# ones stay on aiofiles, where caio's per-call overhead would dominate
+LARGE_WRITE_THRESHOLD = 256 * 1024
+WRITE_CHUNK_SIZE = 64 * 1024
+
+# Reads larger than this are not returned as one string; the file is served in
+# chunks (through caio) by the download endpoint instead
+STREAM_READ_THRESHOLD = 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+# Operations the shared caio context keeps in flight at once
+CAIO_MAX_REQUESTS = 128
+
+T = TypeVar("T")
+
+_UTC = timezone.utc
+
+# One caio context for the process, bound to the loop it was created on
+_caio: Optional[Tuple[asyncio.AbstractEventLoop, caio.AsyncioContext]] = None
+
+def _aio_context() -> caio.AsyncioContext:
+    """The shared caio context; caio picks io_uring, then libaio, then threads"""
+    global _caio
+    loop = asyncio.get_running_loop()
+    if _caio is None or _caio[0] is not loop:
+        close_aio_context()
+        _caio = (loop, caio.AsyncioContext(max_requests=CAIO_MAX_REQUESTS, loop=loop))
+    return _caio[1]
+
+def close_aio_context():
+    """Release the shared caio context, if one was created"""
+    global _caio
+    if _caio is not None:
+        _caio[1].close()
+        _caio = None
+
+# Directory listings kept, keyed by path and mtime
+LIST_CACHE_SIZE = 256
+
+# A listing is only cached once its directory's mtime is this old: filesystems
+# with coarse timestamps (FAT/exFAT: 2s) give two changes within one tick the
+# same mtime, so a newer listing could miss the second change
+LIST_CACHE_MIN_AGE_NS = 2_000_000_000
+
+def _scan_dir(target: str) -> Tuple[str, ...]:
+    """Sorted entry names of a directory"""
+    # scandir yields bare DirEntry names, no Path object per entry
+    with os.scandir(target) as it:
+        return tuple(sorted(entry.name for entry in it))
+
+@lru_cache(maxsize=LIST_CACHE_SIZE)
+def _scan_dir_cached(target: str, mtime_ns: int) -> Tuple[str, ...]:
+    """_scan_dir, reused while the directory's mtime is unchanged"""
+    return _scan_dir(target)
+
 class ToolExecutor:
     """Execute tools safely within sandbox"""
     
     def __init__(self, root_path: str = None):
         self.root_path = Path(root_path or settings.sandbox_path).expanduser()
         self.ensure_sandbox()
+        # Resolve once; child paths are then plain joins with no per-call realpath
+        self.root_path = self.root_path.resolve()
+        self._root_str = str(self.root_path)
+        
+        # Directories already created, so repeat writes skip mkdir
+        self._known_dirs = {self.root_path}
     
     def ensure_sandbox(self):
         """Create sandbox directory if it doesn't exist"""
@@ -20,144 +90,249 @@ class ToolExecutor:
     def get_full_path(self, filename: str) -> Path:
         """Get full path within sandbox"""
         # If it's already an absolute path, check if it's within allowed roots
-        path = Path(filename)
-        if path.is_absolute():
-            return path
-        # Otherwise, resolve relative to sandbox
-        return (self.root_path / filename).resolve()
+        if os.path.isabs(filename):
+            return Path(filename)
+        # Otherwise, relative to the (already resolved) sandbox; a string join
+        # builds one Path instead of two
+        return Path(os.path.join(self._root_str, filename))
     
     def is_safe_path(self, path: Path) -> bool:
         """Check if path is within sandbox or explicitly allowed"""
-        try:
-            # Check if within sandbox
-            path.relative_to(self.root_path)
-            return True
-        except ValueError:
-            # Outside sandbox - would need privilege approval
-            return False
+        # Resolve symlinks first so a link inside the sandbox can't point out of it;
+        # anything outside would need privilege approval
+        resolved = os.path.realpath(path)
+        root = self._root_str
+        return resolved == root or resolved.startswith(os.path.join(root, ""))
+    
+    def check_paths(self, args: Dict[str, Any]):
+        """Raise PermissionError if any path in the action args leaves the sandbox"""
+        for key in self._PATH_ARGS:
+            value = args.get(key)
+            if value and not self.is_safe_path(self.get_full_path(value)):
+                raise PermissionError(f"Path outside sandbox: {value}")
     
-    async def execute(self, tool: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    async def execute(self, tool: str, args: Dict[str, Any], allow_outside: bool = False) -> Dict[str, Any]:
         """Execute a tool and return result"""
+        handler = self._TOOLS.get(tool)
+        if handler is None:
+            raise ValueError(f"Unknown tool: {tool}")
         
-        if tool == "system.time":
-            return await self.system_time()
-        
-        elif tool == "files.write":
-            return await self.files_write(args.get("filename"), args.get("content"))
-        
-        elif tool == "files.read":
-            return await self.files_read(args.get("filename"))
-        
-        elif tool == "files.delete":
-            return await self.files_delete(args.get("filename"))
-        
-        elif tool == "files.copy":
-            return await self.files_copy(args.get("source"), args.get("dest"))
-        
-        elif tool == "files.move":
-            return await self.files_move(args.get("source"), args.get("dest"))
-        
-        elif tool == "files.list":
-            return await self.files_list(args.get("path", ""))
-        
-        elif tool == "apps.open":
-            return await self.apps_open(args.get("app"))
-        
-        elif tool == "privilege.request":
-            # Privilege requests don't execute - they create approval actions
-            return {"status": "pending_approval"}
+        # Resolving symlinks touches the filesystem, so it runs on a worker thread
+        if tool.startswith("files.") and not allow_outside:
+            await asyncio.to_thread(self.check_paths, args)
         
-        else:
-            raise ValueError(f"Unknown tool: {tool}")
+        # Tools without I/O are plain functions and return their result directly
+        result = handler(self, args)
+        return await result if inspect.isawaitable(result) else result
     
-    async def system_time(self) -> Dict[str, Any]:
+    def system_time(self) -> Dict[str, Any]:
         """Get current time"""
-        now = datetime.now(timezone.utc)
+        now = time.time()
         return {
-            "now_iso": now.isoformat(),
-            "unix": now.timestamp()
+            "now_iso": datetime.fromtimestamp(now, _UTC).isoformat(),
+            "unix": now
         }
     
     async def files_write(self, filename: str, content: str) -> Dict[str, Any]:
         """Write file"""
         path = self.get_full_path(filename)
-        path.parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(path, 'w') as f:
-            f.write(content)
-        
+        # Encoded once, so the stored bytes don't depend on which path writes them
+        data = content.encode('utf-8')
+        await self._in_parent_async(path, lambda: self._write_content(path, data))
         return {"bytes_written": len(content)}
     
+    async def _write_content(self, path: Path, data: bytes):
+        if len(data) > LARGE_WRITE_THRESHOLD:
+            async with AIOFile(path, 'wb', context=_aio_context()) as afp:
+                await asyncio.gather(*(
+                    afp.write(data[offset:offset + WRITE_CHUNK_SIZE], offset=offset)
+                    for offset in range(0, len(data), WRITE_CHUNK_SIZE)
+                ))
+        else:
+            async with aiofiles.open(path, 'wb') as f:
+                await f.write(data)
+    
     async def files_read(self, filename: str) -> Dict[str, Any]:
         """Read file"""
         path = self.get_full_path(filename)
         
-        if not path.exists():
-            raise FileNotFoundError(f"File not found: {filename}")
+        # Open directly rather than stat first; the OS reports a missing file.
+        # fstat on the open handle then tells us whether it's too big to inline
+        try:
+            async with aiofiles.open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size > STREAM_READ_THRESHOLD:
+                    return {"streamed": True, "size": size}
+                data = await f.read()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {filename}") from None
         
-        with open(path, 'r') as f:
-            content = f.read()
+        return {"text": data.decode('utf-8')}
+    
+    async def files_read_stream(self, filename: str, chunk: int = READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Read file as a stream of byte chunks"""
+        path = self.get_full_path(filename)
+        
+        afp = AIOFile(path, 'rb', context=_aio_context())
+        try:
+            await afp.open()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {filename}") from None
         
-        return {"text": content}
+        try:
+            async for data in Reader(afp, chunk_size=chunk):
+                yield data
+        finally:
+            await afp.close()
     
     async def files_delete(self, filename: str) -> Dict[str, Any]:
         """Delete file"""
         path = self.get_full_path(filename)
         
-        if not path.exists():
-            raise FileNotFoundError(f"File not found: {filename}")
+        try:
+            await anyio.Path(path).unlink()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {filename}") from None
         
-        path.unlink()
         return {"deleted": True}
     
-    async def files_copy(self, source: str, dest: str) -> Dict[str, Any]:
-        """Copy file"""
+    async def files_copy(self, source: str, dest: str, preserve_metadata: bool = False) -> Dict[str, Any]:
+        """Copy file (contents only unless preserve_metadata)"""
+        return await asyncio.to_thread(self._copy_sync, source, dest, preserve_metadata)
+    
+    async def files_move(self, source: str, dest: str) -> Dict[str, Any]:
+        """Move file"""
+        return await asyncio.to_thread(self._move_sync, source, dest)
+    
+    async def files_list(self, path: str = "") -> Dict[str, Any]:
+        """List files in directory"""
+        return await asyncio.to_thread(self._list_sync, path)
+    
+    async def privilege_request(self) -> Dict[str, Any]:
+        """Privilege requests don't execute - they create approval actions"""
+        return {"status": "pending_approval"}
+    
+    def apps_open(self, app: str) -> Dict[str, Any]:
+        """Open application (simulated)"""
+        # In a real implementation, this would open the actual app
+        # For testing, we just return success
+        return {
+            "opened": True,
+            "app": app,
+            "note": "Application opening is simulated in this version"
+        }
+    
+    # Parent directories are created once and remembered in _known_dirs; the
+    # two variants below share _make_parent/_remake_parent
+    
+    def _make_parent(self, parent: Path):
+        """Create a parent directory and remember it"""
+        parent.mkdir(parents=True, exist_ok=True)
+        self._known_dirs.add(parent)
+    
+    def _remake_parent(self, parent: Path) -> bool:
+        """Recreate a remembered directory that was removed since; False if it still exists"""
+        if parent.is_dir():
+            return False
+        parent.mkdir(parents=True, exist_ok=True)
+        return True
+    
+    def _in_parent(self, path: Path, op: Callable[[], T]) -> T:
+        """Run op, which creates path, after making sure its parent directory exists"""
+        parent = path.parent
+        if parent not in self._known_dirs:
+            self._make_parent(parent)
+            return op()
+        
+        try:
+            return op()
+        except FileNotFoundError:
+            if not self._remake_parent(parent):
+                raise
+            return op()
+    
+    async def _in_parent_async(self, path: Path, op: Callable[[], Awaitable[T]]) -> T:
+        """Async variant of _in_parent; the directory calls run on a worker thread"""
+        parent = path.parent
+        if parent not in self._known_dirs:
+            await asyncio.to_thread(self._make_parent, parent)
+            return await op()
+        
+        try:
+            return await op()
+        except FileNotFoundError:
+            if not await asyncio.to_thread(self._remake_parent, parent):
+                raise
+            return await op()
+    
+    # Blocking implementations, run on a worker thread by the async tools above
+    
+    def _copy_sync(self, source: str, dest: str, preserve_metadata: bool = False) -> Dict[str, Any]:
         src_path = self.get_full_path(source)
         dst_path = self.get_full_path(dest)
+        # Like copy2 and move, copying onto a directory copies into it
+        if dst_path.is_dir():
+            dst_path = dst_path / src_path.name
         
-        if not src_path.exists():
-            raise FileNotFoundError(f"Source file not found: {source}")
-        
-        dst_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(src_path, dst_path)
+        # copyfile skips the stat/chmod/utime of copy2 and lets CPython use
+        # sendfile/copy_file_range for a kernel-side copy
+        copy = shutil.copy2 if preserve_metadata else shutil.copyfile
+        try:
+            self._in_parent(dst_path, lambda: copy(src_path, dst_path))
+        except FileNotFoundError:
+            # Checked only on failure, so a successful copy has no extra stat
+            if not src_path.exists():
+                raise FileNotFoundError(f"Source file not found: {source}") from None
+            raise
         
         return {"copied": True}
     
-    async def files_move(self, source: str, dest: str) -> Dict[str, Any]:
-        """Move file"""
+    def _move_sync(self, source: str, dest: str) -> Dict[str, Any]:
         src_path = self.get_full_path(source)
         dst_path = self.get_full_path(dest)
         
-        if not src_path.exists():
-            raise FileNotFoundError(f"Source file not found: {source}")
-        
-        dst_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.move(str(src_path), str(dst_path))
+        try:
+            self._in_parent(dst_path, lambda: shutil.move(str(src_path), str(dst_path)))
+        except FileNotFoundError:
+            if not src_path.exists():
+                raise FileNotFoundError(f"Source file not found: {source}") from None
+            raise
         
         return {"moved": True}
     
-    async def files_list(self, path: str = "") -> Dict[str, Any]:
-        """List files in directory"""
-        target = self.get_full_path(path) if path else self.root_path
+    def _list_sync(self, path: str = "") -> Dict[str, Any]:
+        target = str(self.get_full_path(path) if path else self.root_path)
         
-        if not target.exists():
+        # Adding or removing an entry bumps the directory's mtime, so one stat
+        # tells us whether a cached listing is still current
+        try:
+            mtime = os.stat(target).st_mtime_ns
+            if time.time_ns() - mtime > LIST_CACHE_MIN_AGE_NS:
+                entries = _scan_dir_cached(target, mtime)
+            else:
+                entries = _scan_dir(target)
+        except FileNotFoundError:
             return {"entries": []}
+        except NotADirectoryError:
+            raise ValueError(f"Not a directory: {path}") from None
         
-        if not target.is_dir():
-            raise ValueError(f"Not a directory: {path}")
-        
-        entries = []
-        for item in target.iterdir():
-            entries.append(item.name)
-        
-        return {"entries": sorted(entries)}
+        return {"entries": list(entries)}
     
-    async def apps_open(self, app: str) -> Dict[str, Any]:
-        """Open application (simulated)"""
-        # In a real implementation, this would open the actual app
-        # For testing, we just return success
-        return {
-            "opened": True,
-            "app": app,
-            "note": "Application opening is simulated in this version"
-        }
\ No newline at end of file
+    # Action args that name a file or directory
+    _PATH_ARGS = ("filename", "source", "dest", "path")
+    
+    # Tool name -> handler taking the executor and the action args; built once
+    # for the class, so one hashed lookup replaces any chain of name comparisons
+    _TOOLS = {
+        "system.time": lambda self, args: self.system_time(),
+        "files.write": lambda self, args: self.files_write(args.get("filename"), args.get("content")),
+        "files.read": lambda self, args: self.files_read(args.get("filename")),
+        "files.delete": lambda self, args: self.files_delete(args.get("filename")),
+        "files.copy": lambda self, args: self.files_copy(
+            args.get("source"), args.get("dest"), args.get("preserve_metadata", False)
+        ),
+        "files.move": lambda self, args: self.files_move(args.get("source"), args.get("dest")),
+        "files.list": lambda self, args: self.files_list(args.get("path", "")),
+        "apps.open": lambda self, args: self.apps_open(args.get("app")),
+        "privilege.request": lambda self, args: self.privilege_request(),
+    }
@@ -2,12 +2,14 @@
 """
 Desktop Guardian Backend API Test Suite
 Tests all backend functionality including session management, planning, file operations, and privilege requests.
+
+Requires: pip install "httpx[http2]" orjson
 """
 
-import requests
-import json
+import asyncio
+import httpx
+import orjson
 import sys
-import time
 from datetime import datetime
 from typing import Dict, Any, Optional
 
@@ -16,9 +18,19 @@ class DesktopGuardianTester:
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
         self.session_id = None
+        self.write_action_id = None
         self.tests_run = 0
         self.tests_passed = 0
         self.test_results = []
+        
+        # One HTTP/2 client; concurrent tests multiplex over a single connection
+        self.http = httpx.AsyncClient(
+            base_url=self.api_url,
+            headers={'Content-Type': 'application/json'},
+            timeout=10,
+            follow_redirects=True,
+            http2=True,
+        )
 
     def log_test(self, name: str, success: bool, details: str = "", response_data: Any = None):
         """Log test result"""
@@ -36,26 +48,23 @@ class DesktopGuardianTester:
             "response_data": response_data
         })
 
-    def make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, expected_status: int = 200) -> tuple[bool, Dict]:
+    async def make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, expected_status: int = 200) -> tuple[bool, Dict]:
         """Make HTTP request and return success status and response data"""
-        url = f"{self.api_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
-        
         try:
             if method == 'GET':
-                response = requests.get(url, headers=headers, timeout=10)
+                response = await self.http.get(endpoint)
             elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers, timeout=10)
+                response = await self.http.post(endpoint, json=data)
             elif method == 'PUT':
-                response = requests.put(url, json=data, headers=headers, timeout=10)
+                response = await self.http.put(endpoint, json=data)
             elif method == 'DELETE':
-                response = requests.delete(url, headers=headers, timeout=10)
+                response = await self.http.delete(endpoint)
             else:
                 return False, {"error": f"Unsupported method: {method}"}
 
             success = response.status_code == expected_status
             try:
-                response_data = response.json()
+                response_data = orjson.loads(response.content)
             except:
                 response_data = {"raw_response": response.text, "status_code": response.status_code}
             
@@ -63,17 +72,32 @@ class DesktopGuardianTester:
         except Exception as e:
             return False, {"error": str(e)}
 
-    def test_basic_connectivity(self):
+    async def wait_for(self, predicate, timeout: float = 5, initial: float = 0.05) -> bool:
+        """Poll an async predicate with exponential backoff until it holds or times out"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not await predicate():
+            if asyncio.get_running_loop().time() >= deadline:
+                return False
+            await asyncio.sleep(initial)
+            initial = min(initial * 2, 0.5)
+        return True
+
+    async def _action_complete(self, action_id: str) -> bool:
+        """Check whether an action has been logged for the current session"""
+        success, data = await self.make_request('GET', f'logs?session_id={self.session_id}')
+        return success and any(log.get('action_id') == action_id for log in data.get('logs', []))
+
+    async def test_basic_connectivity(self):
         """Test basic API connectivity"""
-        success, data = self.make_request('GET', '')
+        success, data = await self.make_request('GET', '')
         expected_message = data.get('message') == 'Hello World'
         self.log_test("Basic API Connectivity", success and expected_message, 
                      f"Expected 'Hello World', got: {data.get('message', 'No message')}", data)
         return success and expected_message
 
-    def test_session_start(self):
+    async def test_session_start(self):
         """Test session creation"""
-        success, data = self.make_request('POST', 'session/start', {'mode': 'normal'})
+        success, data = await self.make_request('POST', 'session/start', {'mode': 'normal'})
         
         if success and 'id' in data:
             self.session_id = data['id']
@@ -86,13 +110,13 @@ class DesktopGuardianTester:
             self.log_test("Session Start", False, f"Failed to create session: {data}", data)
             return False
 
-    def test_simple_plan_execution(self):
+    async def test_simple_plan_execution(self):
         """Test simple plan execution - 'what time is it?'"""
         if not self.session_id:
             self.log_test("Simple Plan Execution", False, "No session ID available")
             return False
 
-        success, data = self.make_request('POST', 'plan', {
+        success, data = await self.make_request('POST', 'plan', {
             'session_id': self.session_id,
             'utterance': 'what time is it?'
         })
@@ -111,14 +135,14 @@ class DesktopGuardianTester:
             self.log_test("Simple Plan Execution (Time)", False, f"Plan request failed: {data}", data)
             return False
 
-    def test_file_write_approval_flow(self):
+    async def test_file_write_approval_flow(self):
         """Test file write with approval flow"""
         if not self.session_id:
             self.log_test("File Write Approval Flow", False, "No session ID available")
             return False
 
         # Step 1: Request file write (should need approval)
-        success, data = self.make_request('POST', 'plan', {
+        success, data = await self.make_request('POST', 'plan', {
             'session_id': self.session_id,
             'utterance': 'write file notes.txt: hello from guardian'
         })
@@ -145,12 +169,13 @@ class DesktopGuardianTester:
 
         # Step 2: Approve the action
         action_id = write_action['id']
-        success, approval_data = self.make_request('POST', 'action/approve', {
+        success, approval_data = await self.make_request('POST', 'action/approve', {
             'action_id': action_id,
             'decision': 'allow'
         })
 
         if success:
+            self.write_action_id = action_id
             self.log_test("File Write Approval Flow", True, 
                          f"File write approved successfully. Action ID: {action_id}", approval_data)
             return True
@@ -159,16 +184,17 @@ class DesktopGuardianTester:
                          f"Failed to approve file write: {approval_data}", approval_data)
             return False
 
-    def test_file_read_approval_flow(self):
+    async def test_file_read_approval_flow(self):
         """Test file read with approval flow"""
         if not self.session_id:
             self.log_test("File Read Approval Flow", False, "No session ID available")
             return False
 
-        # Wait a bit for previous file write to complete
-        time.sleep(2)
+        # Wait for the previous file write to be logged
+        if self.write_action_id:
+            await self.wait_for(lambda: self._action_complete(self.write_action_id))
 
-        success, data = self.make_request('POST', 'plan', {
+        success, data = await self.make_request('POST', 'plan', {
             'session_id': self.session_id,
             'utterance': 'read file notes.txt'
         })
@@ -195,7 +221,7 @@ class DesktopGuardianTester:
 
         # Approve the read action
         action_id = read_action['id']
-        success, approval_data = self.make_request('POST', 'action/approve', {
+        success, approval_data = await self.make_request('POST', 'action/approve', {
             'action_id': action_id,
             'decision': 'allow'
         })
@@ -209,13 +235,13 @@ class DesktopGuardianTester:
                          f"Failed to approve file read: {approval_data}", approval_data)
             return False
 
-    def test_file_delete_approval_flow(self):
+    async def test_file_delete_approval_flow(self):
         """Test file delete with approval flow"""
         if not self.session_id:
             self.log_test("File Delete Approval Flow", False, "No session ID available")
             return False
 
-        success, data = self.make_request('POST', 'plan', {
+        success, data = await self.make_request('POST', 'plan', {
             'session_id': self.session_id,
             'utterance': 'delete file notes.txt'
         })
@@ -242,7 +268,7 @@ class DesktopGuardianTester:
 
         # Approve the delete action
         action_id = delete_action['id']
-        success, approval_data = self.make_request('POST', 'action/approve', {
+        success, approval_data = await self.make_request('POST', 'action/approve', {
             'action_id': action_id,
             'decision': 'allow'
         })
@@ -256,7 +282,7 @@ class DesktopGuardianTester:
                          f"Failed to approve file delete: {approval_data}", approval_data)
             return False
 
-    def test_copy_move_operations(self):
+    async def test_copy_move_operations(self):
         """Test file copy and move operations"""
         if not self.session_id:
             self.log_test("Copy/Move Operations", False, "No session ID available")
@@ -269,7 +295,7 @@ class DesktopGuardianTester:
         ]
         
         for operation in operations:
-            success, data = self.make_request('POST', 'plan', {
+            success, data = await self.make_request('POST', 'plan', {
                 'session_id': self.session_id,
                 'utterance': operation
             })
@@ -278,15 +304,15 @@ class DesktopGuardianTester:
                 # Approve any actions that need approval
                 for action in data.get('actions', []):
                     if action.get('need_approval'):
-                        self.make_request('POST', 'action/approve', {
+                        await self.make_request('POST', 'action/approve', {
                             'action_id': action['id'],
                             'decision': 'allow'
                         })
-            
-            time.sleep(1)  # Wait between operations
+                        # Wait for this op to land before starting the next
+                        await self.wait_for(lambda: self._action_complete(action['id']))
 
         # Test list files to verify a.txt and c.txt exist
-        success, data = self.make_request('POST', 'plan', {
+        success, data = await self.make_request('POST', 'plan', {
             'session_id': self.session_id,
             'utterance': 'list files'
         })
@@ -299,10 +325,60 @@ class DesktopGuardianTester:
             self.log_test("Copy/Move Operations", False, f"Failed to list files: {data}", data)
             return False
 
-    def test_privilege_request_flow(self):
+    async def run_file_lifecycle(self):
+        """Write, read, then delete notes.txt; these depend on each other"""
+        await self.test_file_write_approval_flow()
+        await self.test_file_read_approval_flow()
+        await self.test_file_delete_approval_flow()
+
+    async def test_large_file_download(self):
+        """Test that a large file read is served from its download link"""
+        if not self.session_id:
+            self.log_test("Large File Download", False, "No session ID available")
+            return False
+
+        content = 'x' * (1024 * 1024 + 1)
+        for utterance in (f'write file big.txt: {content}', 'read file big.txt'):
+            success, data = await self.make_request('POST', 'plan', {
+                'session_id': self.session_id,
+                'utterance': utterance
+            })
+            actions = data.get('actions', []) if success else []
+            if not actions:
+                self.log_test("Large File Download", False, f"Plan request failed: {data}", data)
+                return False
+            action = actions[0]
+            if action.get('need_approval'):
+                success, result = await self.make_request('POST', 'action/approve', {
+                    'action_id': action['id'],
+                    'decision': 'allow'
+                })
+            else:
+                result = data.get('auto_results', [{}])[0]
+
+        # Large reads come back as a link rather than inline text
+        download_url = (result.get('result') or {}).get('download_url')
+        if 'text' in (result.get('result') or {}) or not download_url:
+            self.log_test("Large File Download", False, f"Expected a download link: {result.get('result')}",
+                          {"action_id": action['id']})
+            return False
+
+        try:
+            response = await self.http.get(f"{self.base_url}{download_url}")
+        except Exception as e:
+            self.log_test("Large File Download", False, f"Download failed: {e}")
+            return False
+
+        downloaded = response.status_code == 200 and response.content == content.encode()
+        self.log_test("Large File Download", downloaded,
+                      f"Status {response.status_code}, {len(response.content)} bytes",
+                      {"download_url": download_url})
+        return downloaded
+
+    async def test_privilege_request_flow(self):
         """Test privilege request for outside sandbox operations"""
         # Step 1: Request privilege
-        success, data = self.make_request('POST', 'settings/privilege_request', {
+        success, data = await self.make_request('POST', 'settings/privilege_request', {
             'need': ['files.write.outside_sandbox'],
             'target_path': '/tmp/guardian-e2e',
             'expires_minutes': 15,
@@ -320,7 +396,7 @@ class DesktopGuardianTester:
 
         # Step 2: Approve the privilege request
         action_id = action['id']
-        success, approval_data = self.make_request('POST', 'action/approve', {
+        success, approval_data = await self.make_request('POST', 'action/approve', {
             'action_id': action_id,
             'decision': 'allow'
         })
@@ -331,7 +407,7 @@ class DesktopGuardianTester:
             return False
 
         # Step 3: Set new root
-        success, root_data = self.make_request('POST', 'settings/root', {
+        success, root_data = await self.make_request('POST', 'settings/root', {
             'path': '/tmp/guardian-e2e'
         })
 
@@ -344,13 +420,13 @@ class DesktopGuardianTester:
                          f"Failed to set new root: {root_data}", root_data)
             return False
 
-    def test_logs_endpoint(self):
+    async def test_logs_endpoint(self):
         """Test logs retrieval"""
         if not self.session_id:
             self.log_test("Logs Endpoint", False, "No session ID available")
             return False
 
-        success, data = self.make_request('GET', f'logs?session_id={self.session_id}')
+        success, data = await self.make_request('GET', f'logs?session_id={self.session_id}')
         
         if success and 'logs' in data:
             logs = data['logs']
@@ -361,9 +437,9 @@ class DesktopGuardianTester:
             self.log_test("Logs Endpoint", False, f"Failed to retrieve logs: {data}", data)
             return False
 
-    def test_settings_root_get(self):
+    async def test_settings_root_get(self):
         """Test getting current root settings"""
-        success, data = self.make_request('GET', 'settings/root')
+        success, data = await self.make_request('GET', 'settings/root')
         
         if success and 'root' in data:
             self.log_test("Settings Root GET", True, 
@@ -373,30 +449,37 @@ class DesktopGuardianTester:
             self.log_test("Settings Root GET", False, f"Failed to get root settings: {data}", data)
             return False
 
-    def run_all_tests(self):
+    async def run_all_tests(self):
         """Run all backend tests"""
         print("🚀 Starting Desktop Guardian Backend Tests")
         print("=" * 50)
         
-        # Basic connectivity
-        if not self.test_basic_connectivity():
-            print("❌ Basic connectivity failed, stopping tests")
-            return False
-
-        # Session management
-        if not self.test_session_start():
-            print("❌ Session creation failed, stopping tests")
-            return False
+        async with self.http:
+            # Session-independent checks
+            connected, _ = await asyncio.gather(
+                self.test_basic_connectivity(),
+                self.test_settings_root_get(),
+            )
+            if not connected:
+                print("❌ Basic connectivity failed, stopping tests")
+                return False
+
+            # Session management
+            if not await self.test_session_start():
+                print("❌ Session creation failed, stopping tests")
+                return False
+
+            # Core functionality tests; each group touches its own files
+            await asyncio.gather(
+                self.test_simple_plan_execution(),
+                self.run_file_lifecycle(),
+                self.test_copy_move_operations(),
+                self.test_large_file_download(),
+            )
 
-        # Core functionality tests
-        self.test_simple_plan_execution()
-        self.test_file_write_approval_flow()
-        self.test_file_read_approval_flow()
-        self.test_file_delete_approval_flow()
-        self.test_copy_move_operations()
-        self.test_privilege_request_flow()
-        self.test_logs_endpoint()
-        self.test_settings_root_get()
+            # Moves the root, so it has to wait for the file tests
+            await self.test_privilege_request_flow()
+            await self.test_logs_endpoint()
 
         # Print summary
         print("\n" + "=" * 50)
@@ -411,17 +494,17 @@ class DesktopGuardianTester:
 
 def main():
     tester = DesktopGuardianTester()
-    success = tester.run_all_tests()
+    success = asyncio.run(tester.run_all_tests())
     
     # Save detailed results
-    with open('/app/backend_test_results.json', 'w') as f:
-        json.dump({
-            'timestamp': datetime.now().isoformat(),
+    with open('/app/backend_test_results.json', 'wb') as f:
+        f.write(orjson.dumps({
+            'timestamp': datetime.now(),
             'total_tests': tester.tests_run,
             'passed_tests': tester.tests_passed,
             'success_rate': tester.tests_passed / tester.tests_run if tester.tests_run > 0 else 0,
             'test_results': tester.test_results
-        }, f, indent=2)
+        }, option=orjson.OPT_INDENT_2))
     
     return 0 if success else 1
 
@@ -24,7 +24,7 @@ const useWebSocket = (sessionId) => {
   const [status, setStatus] = useState("disconnected");
   const [events, setEvents] = useState([]);
   const wsRef = useRef(null);
-  useEffect(() => { if (!sessionId) return; try { const wsUrl = BACKEND_URL.replace(/^http/, "ws") + `/api/ws/${sessionId}`; const ws = new WebSocket(wsUrl); wsRef.current = ws; ws.onopen = () => setStatus("connected"); ws.onclose = () => setStatus("disconnected"); ws.onerror = () => setStatus("error"); ws.onmessage = (ev) => { try { const msg = JSON.parse(ev.data); setEvents((prev) => [...prev, msg]); } catch (_) {} }; return () => ws.close(); } catch (_) { setStatus("error"); } }, [sessionId]);
+  useEffect(() => { if (!sessionId) return; try { const wsUrl = BACKEND_URL.replace(/^http/, "ws") + `/api/ws/${sessionId}`; const ws = new WebSocket(wsUrl); wsRef.current = ws; ws.onopen = () => setStatus("connected"); ws.onclose = () => setStatus("disconnected"); ws.onerror = () => setStatus("error"); ws.onmessage = (ev) => { try { const msg = JSON.parse(ev.data); const msgs = msg.event === "batch" ? msg.data : [msg]; setEvents((prev) => [...prev, ...msgs]); } catch (_) {} }; return () => ws.close(); } catch (_) { setStatus("error"); } }, [sessionId]);
   return { status, events };
 };
 
@@ -84,7 +84,9 @@ function App() {
     fetchLogs(); const id = setInterval(fetchLogs, 2000); return () => clearInterval(id);
   }, [session?.id]);
 
-  useEffect(() => { const evt = events.at(-1); if (!evt) return; if (evt.event === "tool_result") { toast.success("Tool executed"); if (session?.id) { axios.get(`${API}/logs`, { params: { session_id: session.id } }).then(({ data }) => setLogs(data.logs || [])); } } }, [events, session?.id]);
+  // A batch frame can add several events at once, so handle every event since the last run
+  const seenEventsRef = useRef(0);
+  useEffect(() => { const fresh = events.slice(seenEventsRef.current); seenEventsRef.current = events.length; const results = fresh.filter((evt) => evt.event === "tool_result"); if (!results.length) return; results.forEach(() => toast.success("Tool executed")); if (session?.id) { axios.get(`${API}/logs`, { params: { session_id: session.id } }).then(({ data }) => setLogs(data.logs || [])); } }, [events, session?.id]);
 
   const proposePlan = async (maybeUtterance) => { const u = (maybeUtterance ?? utterance).trim(); if (!u) return toast.info("Enter a command"); if (!session?.id) return toast.error("No session"); try { const { data } = await axios.post(`${API}/plan`, { session_id: session.id, utterance: u }); setPlans(data.actions || []); if ((data.auto_results || []).length) toast.success("Executed non-risky actions"); } catch (_) { toast.error("Failed to propose plan"); } };
 
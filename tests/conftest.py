@@ -0,0 +1,44 @@
+"""Shared fixtures for the backend tests"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Point the app at throwaway paths before app.config is imported
+_TMP = tempfile.mkdtemp(prefix="axion-tests-")
+os.environ["DB_PATH"] = os.path.join(_TMP, "axion.db")
+os.environ["SANDBOX_PATH"] = os.path.join(_TMP, "sandbox")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from app.storage import Storage  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "axion.db")
+
+
+@pytest.fixture
+async def make_storage(db_path):
+    """Build SQLite-backed Storage instances sharing one database file"""
+    opened = []
+
+    async def make():
+        storage = Storage()
+        storage.db_path = db_path
+        storage.mode = "sqlite"
+        await storage.init_db()
+        opened.append(storage)
+        return storage
+
+    yield make
+    for storage in opened:
+        await storage.close()
@@ -0,0 +1,142 @@
+"""HTTP API, exercised in-process through TestClient"""
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.storage import LOG_CACHE_SIZE, storage
+from app.tools import STREAM_READ_THRESHOLD
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def start_session(client, mode="normal"):
+    return client.post("/api/session/start", json={"mode": mode}).json()
+
+
+def plan(client, session, utterance):
+    return client.post("/api/plan", json={"session_id": session["id"], "utterance": utterance}).json()
+
+
+def approve(client, action):
+    return client.post("/api/action/approve", json={"action_id": action["id"], "decision": "allow"}).json()
+
+
+@pytest.fixture
+def big_file(client):
+    session = start_session(client)
+    blob = os.urandom(STREAM_READ_THRESHOLD + 7)
+    path = os.path.join(session["root_path"], "big.bin")
+    os.makedirs(session["root_path"], exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(blob)
+    yield path, blob
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def test_large_read_on_approval_links_to_download(client, big_file):
+    path, blob = big_file
+    session = start_session(client)
+    action = plan(client, session, "read file big.bin")["actions"][0]
+
+    # The approve endpoint keeps its JSON shape; the bytes come from the download link
+    response = approve(client, action)
+    assert response["success"] is True
+    result = response["result"]
+    assert result["streamed"] is True and result["size"] == len(blob) and "text" not in result
+
+    download = client.get(result["download_url"])
+    assert download.status_code == 200
+    assert download.headers["content-type"] == "application/octet-stream"
+    assert download.headers["x-action-id"] == action["id"]
+    assert download.content == blob
+
+
+def test_large_read_auto_executed_is_not_inlined(client, big_file):
+    path, blob = big_file
+    session = start_session(client, "hands_free")
+    result = plan(client, session, "read file big.bin")["auto_results"][0]["result"]
+
+    assert "text" not in result
+    assert client.get(result["download_url"]).content == blob
+
+
+def test_download_of_removed_file_is_404(client, big_file):
+    path, blob = big_file
+    session = start_session(client, "hands_free")
+    result = plan(client, session, "read file big.bin")["auto_results"][0]["result"]
+
+    os.remove(path)
+    download = client.get(result["download_url"])
+    assert download.status_code == 404
+    assert "File not found" in download.json()["detail"]
+
+
+def test_download_needs_a_streamed_read(client):
+    session = start_session(client, "hands_free")
+    action = plan(client, session, "what time is it?")["actions"][0]
+
+    download = client.get(f"/api/action/{action['id']}/download", params={"session_id": session["id"]})
+    assert download.status_code == 404
+
+
+def test_small_read_is_inline(client):
+    session = start_session(client, "hands_free")
+    plan(client, session, "write file small.txt: hello")
+    result = plan(client, session, "read file small.txt")["auto_results"][0]["result"]
+    assert result == {"text": "hello"}
+
+
+@pytest.mark.parametrize("mode, allowed", [("normal", False), ("hands_free", True)])
+def test_symlink_out_of_sandbox_needs_scope(client, tmp_path, mode, allowed):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("secret")
+    session = start_session(client, mode)
+    link = os.path.join(session["root_path"], "escape.txt")
+    os.makedirs(session["root_path"], exist_ok=True)
+    os.symlink(secret, link)
+    try:
+        response = plan(client, session, "read file escape.txt")
+        action = response["actions"][0]
+        result = response["auto_results"][0] if not action["need_approval"] else approve(client, action)
+    finally:
+        os.remove(link)
+
+    if allowed:
+        assert result["result"] == {"text": "secret"}
+    else:
+        assert not result["success"] and "outside sandbox" in result["error"]
+
+
+def test_logs_after_restart():
+    with TestClient(app) as client:
+        session = start_session(client, "hands_free")
+        plan(client, session, "what time is it?")
+        plan(client, session, "what time is it?")
+
+    # A fresh process starts with empty caches
+    storage.__init__()
+    with TestClient(app) as restarted:
+        plan(restarted, session, "what time is it?")
+        logs = restarted.get("/api/logs", params={"session_id": session["id"]}).json()["logs"]
+    assert len(logs) == 3
+
+
+def test_logs_default_to_the_cache_size(client, monkeypatch):
+    limits = []
+    fetch_logs = storage.fetch_logs
+
+    async def recording_fetch_logs(session_id, limit=-1):
+        limits.append(limit)
+        return await fetch_logs(session_id, limit)
+
+    monkeypatch.setattr(storage, "fetch_logs", recording_fetch_logs)
+    session = start_session(client)
+    client.get("/api/logs", params={"session_id": session["id"]})
+    assert limits == [LOG_CACHE_SIZE]
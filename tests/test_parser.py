@@ -0,0 +1,25 @@
+"""Rule-based utterance parsing"""
+import pytest
+
+from app.parser import parse
+
+
+@pytest.mark.parametrize("utterance, intent, args", [
+    ("what time is it?", "system.time", {}),
+    ("Time", "system.time", {}),
+    ("write file notes.txt: Hello There", "files.write", {"filename": "notes.txt", "content": "hello there"}),
+    ("read file notes.txt", "files.read", {"filename": "notes.txt"}),
+    ("delete file a.txt", "files.delete", {"filename": "a.txt"}),
+    ("copy file a.txt to b.txt", "files.copy", {"source": "a.txt", "dest": "b.txt"}),
+    ("move file a.txt to b.txt", "files.move", {"source": "a.txt", "dest": "b.txt"}),
+    ("ls", "files.list", {"path": ""}),
+    ("list files in sub/dir", "files.list", {"path": "sub/dir"}),
+    ("ls\tin docs", "files.list", {"path": "docs"}),
+    ("dir\tin docs", "files.list", {"path": "docs"}),
+    ("open chrome", "apps.open", {"app": "chrome"}),
+    ("  dance  ", "unknown", {"utterance": "  dance  "}),
+    ("", "unknown", {"utterance": ""}),
+])
+def test_parse(utterance, intent, args):
+    result = parse(utterance)
+    assert (result.intent, result.args) == (intent, args)
@@ -0,0 +1,228 @@
+"""Storage: write-behind persistence and the per-session log cache"""
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import storage as storage_module
+from app.models import Action, LogEntry, Session
+
+pytestmark = pytest.mark.anyio
+
+_T0 = datetime.now(timezone.utc) - timedelta(minutes=5)
+
+
+def make_session(**kwargs):
+    return Session(mode="normal", allowed_scopes=["system.read"], expires_in_minutes=60, **kwargs)
+
+
+def make_log(session_id, n):
+    return LogEntry(
+        action_id=f"{session_id}-{n}",
+        tool="system.time",
+        args={},
+        success=True,
+        result={"n": n},
+        # Distinct timestamps, since SQLite orders logs by them
+        timestamp=_T0 + timedelta(seconds=n),
+        session_id=session_id,
+    )
+
+
+def make_action(session_id):
+    return Action(
+        tool="files.read",
+        args={"filename": "a.txt"},
+        need_approval=True,
+        reason_brief="test",
+        risk="medium",
+        session_id=session_id,
+    )
+
+
+def numbers(logs):
+    return [log.result["n"] for log in logs]
+
+
+async def test_logs_survive_restart(make_storage):
+    storage = await make_storage()
+    session = make_session()
+    await storage.save_session(session)
+    for n in range(2):
+        await storage.save_log(make_log(session.id, n))
+    await storage.close()
+
+    # After a restart the cache starts empty; a new entry must not hide the saved ones
+    restarted = await make_storage()
+    assert restarted.get_session(session.id) is not None
+    await restarted.save_log(make_log(session.id, 2))
+
+    logs = await restarted.fetch_logs(session.id)
+    assert numbers(logs) == [0, 1, 2]
+
+    # The history now lives in the cache, and later entries are appended to it
+    await restarted.save_log(make_log(session.id, 3))
+    logs = await restarted.fetch_logs(session.id)
+    assert numbers(logs) == [0, 1, 2, 3]
+
+
+def read_settings(db_path):
+    with sqlite3.connect(db_path) as con:
+        return dict(con.execute("SELECT key, value FROM settings"))
+
+
+async def test_failed_write_does_not_drop_its_batch(make_storage, db_path):
+    storage = await make_storage()
+
+    # Queued back to back, so the writer takes all three in one batch
+    await storage.save_setting("before", "1")
+    storage._enqueue([("INSERT INTO missing_table VALUES (?)", (1,))])
+    await storage.save_setting("after", "2")
+    await storage._flush()
+
+    saved = read_settings(db_path)
+    assert saved["before"] == "1" and saved["after"] == "2"
+
+
+async def test_close_does_not_hang_when_writer_died(make_storage):
+    storage = await make_storage()
+    storage._writer.cancel()
+    await asyncio.sleep(0)
+
+    await storage.save_setting("orphaned", "1")
+    await asyncio.wait_for(storage.close(), timeout=1)
+
+
+async def test_writer_batches_and_groups_statements(make_storage, db_path):
+    storage = await make_storage()
+    db = storage._db
+    calls = []
+    executemany, commit = db.executemany, db.commit
+
+    async def counting_executemany(sql, params):
+        calls.append((sql, len(params)))
+        return await executemany(sql, params)
+
+    async def counting_commit():
+        calls.append(("COMMIT", 0))
+        return await commit()
+
+    db.executemany, db.commit = counting_executemany, counting_commit
+
+    # Queued without yielding, so the writer takes them as one batch
+    for n in range(3):
+        await storage.save_log(make_log("s", n))
+    for key in ("a", "b"):
+        await storage.save_setting(key, key)
+    await storage._flush()
+
+    assert calls == [
+        (storage_module._INSERT_LOG, 3),
+        (storage_module._INSERT_SETTING, 2),
+        ("COMMIT", 0),
+    ]
+    assert read_settings(db_path)["b"] == "b"
+
+
+async def test_atomic_finalize_logs_and_drops_the_action(make_storage, db_path):
+    storage = await make_storage()
+    session = make_session()
+    action = make_action(session.id)
+    await storage.save_session(session)
+    await storage.save_action(action)
+    await storage._flush()
+
+    log = make_log(session.id, 0)
+    log.action_id = action.id
+    await storage.atomic_finalize(log, action.id)
+    await storage._flush()
+
+    assert storage.get_action(action.id) is None
+    with sqlite3.connect(db_path) as con:
+        assert con.execute("SELECT COUNT(*) FROM actions").fetchone()[0] == 0
+        assert con.execute("SELECT action_id FROM logs").fetchall() == [(action.id,)]
+
+
+async def test_restart_warms_settings_sessions_and_pending_actions(make_storage):
+    storage = await make_storage()
+    recent = make_session()
+    expired = make_session(created_at=datetime.now(timezone.utc) - timedelta(days=2))
+    action = make_action(recent.id)
+    await storage.save_setting("first_run", False)
+    await storage.save_session(recent)
+    await storage.save_session(expired)
+    await storage.save_action(action)
+    await storage.close()
+
+    restarted = await make_storage()
+    assert restarted.get_setting("first_run") is False
+    assert restarted.get_session(recent.id) == recent
+    assert restarted.get_session(expired.id) is None
+    assert restarted.get_action(action.id) == action
+
+
+async def test_fetch_logs_limit(make_storage):
+    storage = await make_storage()
+    session = make_session()
+    await storage.save_session(session)
+    for n in range(5):
+        await storage.save_log(make_log(session.id, n))
+
+    assert numbers(await storage.fetch_logs(session.id, limit=2)) == [3, 4]
+    await storage.close()
+
+    # Same answer from SQLite after a restart
+    restarted = await make_storage()
+    assert numbers(await restarted.fetch_logs(session.id, limit=2)) == [3, 4]
+    assert numbers(await restarted.fetch_logs(session.id)) == [0, 1, 2, 3, 4]
+
+
+async def test_fetch_logs_reads_sqlite_once_cache_evicts(make_storage, monkeypatch):
+    monkeypatch.setattr(storage_module, "LOG_CACHE_SIZE", 3)
+    storage = await make_storage()
+    session = make_session()
+    await storage.save_session(session)
+    for n in range(5):
+        await storage.save_log(make_log(session.id, n))
+
+    assert len(storage.logs[session.id]) == 3
+    assert numbers(await storage.fetch_logs(session.id)) == [0, 1, 2, 3, 4]
+
+
+async def test_fetch_logs_serves_a_covered_limit_from_the_cache(make_storage, monkeypatch):
+    monkeypatch.setattr(storage_module, "LOG_CACHE_SIZE", 3)
+    storage = await make_storage()
+    session = make_session()
+    await storage.save_session(session)
+    for n in range(5):
+        await storage.save_log(make_log(session.id, n))
+
+    async def no_sqlite():
+        raise AssertionError("read SQLite")
+
+    monkeypatch.setattr(storage, "_conn", no_sqlite)
+    assert numbers(await storage.fetch_logs(session.id, limit=3)) == [2, 3, 4]
+
+
+async def test_fetch_logs_for_unknown_session_caches_nothing(make_storage):
+    storage = await make_storage()
+
+    assert await storage.fetch_logs("unknown") == []
+    assert "unknown" not in storage.logs
+    assert "unknown" not in storage._logs_complete
+
+
+async def test_get_log_reads_sqlite_for_entries_not_cached(make_storage):
+    storage = await make_storage()
+    session = make_session()
+    await storage.save_session(session)
+    for n in range(2):
+        await storage.save_log(make_log(session.id, n))
+    await storage.close()
+
+    restarted = await make_storage()
+    await restarted.save_log(make_log(session.id, 2))
+    assert (await restarted.get_log(session.id, f"{session.id}-2")).result == {"n": 2}
+    assert (await restarted.get_log(session.id, f"{session.id}-0")).result == {"n": 0}
+    assert await restarted.get_log("other", f"{session.id}-0") is None
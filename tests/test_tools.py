@@ -0,0 +1,150 @@
+"""ToolExecutor file tools"""
+import os
+import shutil
+
+import pytest
+
+from app import tools
+from app.tools import LARGE_WRITE_THRESHOLD, ToolExecutor
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def executor(tmp_path):
+    return ToolExecutor(str(tmp_path / "sandbox"))
+
+
+@pytest.mark.parametrize("tool, args", [
+    ("files.write", {"filename": "d/out.txt", "content": "x"}),
+    ("files.copy", {"source": "src.txt", "dest": "d/out.txt"}),
+])
+async def test_removed_parent_is_recreated(executor, tool, args):
+    await executor.execute("files.write", {"filename": "src.txt", "content": "x"})
+    await executor.execute(tool, args)
+
+    # The directory is remembered as created; removing it must not break later writes
+    shutil.rmtree(executor.root_path / "d")
+    await executor.execute(tool, args)
+    assert (executor.root_path / "d" / "out.txt").read_text() == "x"
+
+
+@pytest.mark.parametrize("tool", ["files.copy", "files.move"])
+async def test_missing_source_is_reported(executor, tool):
+    with pytest.raises(FileNotFoundError, match="Source file not found: nope.txt"):
+        await executor.execute(tool, {"source": "nope.txt", "dest": "d/out.txt"})
+
+
+@pytest.mark.parametrize("tool", ["files.copy", "files.move"])
+async def test_into_existing_directory(executor, tool):
+    await executor.execute("files.write", {"filename": "a.txt", "content": "a"})
+    (executor.root_path / "docs").mkdir()
+
+    await executor.execute(tool, {"source": "a.txt", "dest": "docs"})
+    assert (executor.root_path / "docs" / "a.txt").read_text() == "a"
+
+
+@pytest.mark.parametrize("repeat", [1, LARGE_WRITE_THRESHOLD // 8])
+async def test_write_read_round_trip_is_exact(executor, repeat):
+    # Small contents go through aiofiles, large ones through the chunked caio path
+    content = "héllo\nwörld\r\nend" * repeat
+    await executor.execute("files.write", {"filename": "notes.txt", "content": content})
+
+    assert (executor.root_path / "notes.txt").read_bytes() == content.encode("utf-8")
+    result = await executor.execute("files.read", {"filename": "notes.txt"})
+    assert result == {"text": content}
+
+
+async def test_executors_share_one_caio_context(tmp_path):
+    big = "x" * (LARGE_WRITE_THRESHOLD + 1)
+    contexts = []
+    for root in ("a", "b"):
+        executor = ToolExecutor(str(tmp_path / root))
+        await executor.execute("files.write", {"filename": "big.txt", "content": big})
+        contexts.append(tools._aio_context())
+    assert contexts[0] is contexts[1]
+
+    tools.close_aio_context()
+    assert tools._caio is None
+
+
+def age_dir(path, seconds=60):
+    """Backdate a directory's mtime so its listing can be cached"""
+    mtime = os.stat(path).st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+    return os.stat(path).st_mtime_ns
+
+
+async def test_list_cache_follows_directory_changes(executor):
+    await executor.execute("files.write", {"filename": "a.txt", "content": "a"})
+    age_dir(executor.root_path)
+    assert (await executor.execute("files.list", {}))["entries"] == ["a.txt"]
+    hits = tools._scan_dir_cached.cache_info().hits
+    assert (await executor.execute("files.list", {}))["entries"] == ["a.txt"]
+    assert tools._scan_dir_cached.cache_info().hits == hits + 1
+
+    await executor.execute("files.write", {"filename": "b.txt", "content": "b"})
+    assert (await executor.execute("files.list", {}))["entries"] == ["a.txt", "b.txt"]
+
+
+async def test_list_cache_ignores_recent_mtimes(executor):
+    # Two changes within one coarse timestamp tick leave the mtime unchanged
+    await executor.execute("files.write", {"filename": "a.txt", "content": "a"})
+    mtime = os.stat(executor.root_path).st_mtime_ns
+    assert (await executor.execute("files.list", {}))["entries"] == ["a.txt"]
+
+    await executor.execute("files.write", {"filename": "b.txt", "content": "b"})
+    os.utime(executor.root_path, ns=(mtime, mtime))
+    assert (await executor.execute("files.list", {}))["entries"] == ["a.txt", "b.txt"]
+
+
+async def test_cached_listing_is_not_shared(executor):
+    await executor.execute("files.write", {"filename": "a.txt", "content": "a"})
+    age_dir(executor.root_path)
+
+    first = await executor.execute("files.list", {})
+    first["entries"].append("b.txt")
+    assert await executor.execute("files.list", {}) == {"entries": ["a.txt"]}
+
+
+@pytest.fixture
+def outside(tmp_path):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("secret")
+    return secret
+
+
+def test_is_safe_path(executor, outside):
+    root = executor.root_path
+    (root / "sub").mkdir()
+    (root / "link.txt").symlink_to(outside)
+    sibling = root.parent / (root.name + "x")
+    sibling.mkdir()
+
+    assert executor.is_safe_path(root)
+    assert executor.is_safe_path(root / "sub" / "new.txt")
+    assert executor.is_safe_path(root / "sub" / ".." / "a.txt")
+    assert not executor.is_safe_path(root / "link.txt")
+    assert not executor.is_safe_path(root / ".." / "secret.txt")
+    assert not executor.is_safe_path(sibling / "a.txt")
+
+
+@pytest.mark.parametrize("tool, args", [
+    ("files.read", {"filename": "link.txt"}),
+    ("files.read", {"filename": "../secret.txt"}),
+    ("files.write", {"filename": "../sandboxx/a.txt", "content": "x"}),
+    ("files.copy", {"source": "link.txt", "dest": "copy.txt"}),
+    ("files.list", {"path": ".."}),
+])
+async def test_paths_outside_sandbox_are_refused(executor, outside, tool, args):
+    (executor.root_path / "link.txt").symlink_to(outside)
+
+    with pytest.raises(PermissionError, match="Path outside sandbox"):
+        await executor.execute(tool, args)
+
+
+async def test_outside_paths_allowed_with_scope(executor, outside):
+    (executor.root_path / "link.txt").symlink_to(outside)
+
+    result = await executor.execute("files.read", {"filename": "link.txt"}, allow_outside=True)
+    assert result == {"text": "secret"}